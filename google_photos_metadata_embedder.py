@@ -1,55 +1,124 @@
 import os
+import contextlib
+import errno
+import io
 import json
-from datetime import datetime, timezone
+import time
+import shutil
+import struct
+import zlib
 import piexif
-from PIL import Image, PngImagePlugin
+from piexif.helper import UserComment
 import argparse # Import argparse module
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-def is_image(filename):
-    """Checks if the file is an image based on its extension and not a macOS '._' file."""
-    return filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')) and not os.path.basename(filename).startswith("._")
+# orjson is optional; it parses the JSON sidecars noticeably faster than the stdlib
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
-def is_jpeg(filename):
-    """Checks if the file is a JPEG."""
-    return filename.lower().endswith(('.jpg', '.jpeg'))
+# tqdm is optional; without it no progress bar is shown
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
 
-def is_png(filename):
-    """Checks if the file is a PNG."""
-    return filename.lower().endswith('.png')
+# Outcomes reported back by the worker processes in process_directory
+STATUS_EMBEDDED = "embedded"
+STATUS_TIMESTAMPED = "embedded_timestamped" # Embedded, and the file time was set too
+STATUS_FAILED = "failed"
+STATUS_JSON_FAILED = "json_failed"
+STATUS_NO_JSON = "no_json"
 
-def find_json_file(media_path):
+# Images handed to a worker process at a time, and threads per worker reading their JSON ahead
+BATCH_SIZE = 32
+JSON_PREFETCH_THREADS = 4
+
+# Per-process JSON prefetch thread pool, created lazily by _get_prefetch_pool
+_prefetch_pool = None
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Sidecar suffixes tried by find_json_file, in order of preference
+JSON_SUFFIXES = (
+    '.supplemental-metadata.json',
+    '.suppl.json',
+    # Added .json as a common alternative for Google Takeout
+    '.json',
+)
+
+# Path to the uploading device type in the Google Photos JSON metadata
+DEVICE_TYPE_KEYS = ("googlePhotosOrigin", "mobileUpload", "deviceType")
+
+# Image kinds by lower-cased file extension
+IMAGE_KINDS = {'jpg': 'jpeg', 'jpeg': 'jpeg', 'png': 'png', 'gif': 'gif'}
+
+def classify_image(lower_name):
+    """
+    Classifies an already lower-cased file name as 'jpeg', 'png' or 'gif' based on its extension.
+    Returns None for other files and for macOS '._' files.
+    """
+    if lower_name.startswith("._"):
+        return None
+    _, dot, ext = lower_name.rpartition('.')
+    return IMAGE_KINDS.get(ext) if dot else None
+
+def find_json_file(media_path, filenames):
     """
     Attempts to find the Google Photos metadata JSON file associated with a media file.
     Checks for .supplemental-metadata.json and .suppl.json suffixes.
+    filenames maps the names in the media file's directory (as built by the
+    directory walk) to themselves, plus each lower-cased name to a real name,
+    so no stat() is needed per candidate. An exact match wins; otherwise the
+    candidate is matched case-insensitively, like on case-insensitive volumes.
     """
-    candidates = [
-        media_path + '.supplemental-metadata.json',
-        media_path + '.suppl.json',
-        # Added .json as a common alternative for Google Takeout
-        media_path + '.json' 
-    ]
-    for path in candidates:
-        if os.path.exists(path):
-            return path
+    root, name = os.path.split(media_path)
+    for suffix in JSON_SUFFIXES:
+        candidate = name + suffix
+        found = filenames.get(candidate) or filenames.get(candidate.lower())
+        if found:
+            return os.path.join(root, found)
     return None
 
-def read_json_metadata(json_path):
+def _deep_get(data, keys):
+    """
+    Follows a chain of keys through nested dicts.
+    Returns None as soon as a key is missing or a value is not a dict.
+    """
+    for key in keys:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+        if data is None:
+            return None
+    return data
+
+def read_file(path):
+    """Reads the whole contents of a file (JSON metadata or image) as bytes."""
+    with open(path, 'rb') as f:
+        return f.read()
+
+def read_json_metadata(json_path, prefetched=None):
     """
     Reads the JSON metadata file and extracts the photo taken time.
     Converts timestamp to a formatted datetime string.
+    prefetched is an optional Future already reading json_path with read_file.
+    Returns (metadata, datetime string, Unix timestamp).
     """
     try:
-        with open(json_path, 'r') as f:
-            metadata = json.load(f)
+        json_bytes = prefetched.result() if prefetched else read_file(json_path)
+        metadata = json_loads(json_bytes)
         if 'photoTakenTime' in metadata and 'timestamp' in metadata['photoTakenTime']:
             ts = int(metadata['photoTakenTime']['timestamp'])
-            dt = datetime.fromtimestamp(ts, timezone.utc)
-            dt_str = dt.strftime('%Y:%m:%d %H:%M:%S')
-            return metadata, dt_str
-        return metadata, None
+            tm = time.gmtime(ts)
+            dt_str = "%04d:%02d:%02d %02d:%02d:%02d" % (tm.tm_year, tm.tm_mon, tm.tm_mday, tm.tm_hour, tm.tm_min, tm.tm_sec)
+            return metadata, dt_str, ts
+        return metadata, None, None
     except Exception as e:
         print(f"⚠️ Failed to read JSON {json_path}: {e}")
-        return None, None
+        return None, None, None
 
 def add_gps_info(exif_dict, lat, lng, alt):
     """
@@ -57,11 +126,10 @@ def add_gps_info(exif_dict, lat, lng, alt):
     Converts decimal coordinates to degrees, minutes, seconds format for EXIF.
     """
     def to_deg(value):
-        abs_val = abs(value)
-        deg = int(abs_val)
-        min_float = (abs_val - deg) * 60
-        min = int(min_float)
-        sec = round((min_float - min) * 60 * 10000)
+        # Round once to ticks of 1/10000 arc-second, then split with integer divmod
+        ticks = round(abs(value) * 3600 * 10000)
+        deg, rem = divmod(ticks, 3600 * 10000)
+        min, sec = divmod(rem, 60 * 10000)
         return ((deg, 1), (min, 1), (sec, 10000))
 
     gps_ifd = {}
@@ -76,13 +144,96 @@ def add_gps_info(exif_dict, lat, lng, alt):
         gps_ifd[piexif.GPSIFD.GPSAltitudeRef] = 0 if alt >= 0 else 1 # 0 for above sea level, 1 for below sea level
     exif_dict['GPS'] = gps_ifd
 
+@contextlib.contextmanager
+def _atomic_replace(path):
+    """
+    Yields a temporary file, opened for binary writing, that replaces path when the block exits.
+    Symlinks are resolved first, so the file they point to is replaced and the
+    link itself is kept. A file that is not writable raises PermissionError,
+    just like opening it for writing would, instead of being replaced.
+    The original file's permission bits are copied to the new file. Since the
+    file is replaced rather than rewritten, other hard links to it keep
+    pointing at the old contents.
+    If the block raises, the temporary file is removed and path is left untouched.
+    """
+    path = os.path.realpath(path)
+    if not os.access(path, os.W_OK):
+        raise PermissionError(errno.EACCES, os.strerror(errno.EACCES), path)
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            yield f
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_file_atomic(path, data):
+    """
+    Writes data to a temporary file next to path and moves it into place,
+    so an interrupted write never leaves a truncated image behind.
+    Symlinked images are updated through the link, read-only images are
+    refused; see _atomic_replace for how permissions and hard links are handled.
+    """
+    with _atomic_replace(path) as f:
+        f.write(data)
+
+def read_jpeg_exif(image_path):
+    """
+    Returns the EXIF data of a JPEG (the payload of its 'Exif' APP1 segment),
+    or None if the file does not start like a JPEG or no EXIF segment is found
+    before the image data; callers then fall back to a full piexif.load.
+    Walks the marker segments from the start of the file and seeks over
+    everything else, so only the header segments are read, not the whole image.
+    """
+    with open(image_path, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            marker = f.read(4)
+            if len(marker) < 4 or marker[0] != 0xff:
+                return None
+            size = int.from_bytes(marker[2:], "big")
+            if marker[1] == 0xda: # SOS: the image data starts, no more APP segments
+                return None
+            if marker[1] == 0xe1:
+                body = f.read(size - 2)
+                if body[:6] == b"Exif\x00\x00":
+                    return body
+            else:
+                f.seek(size - 2, os.SEEK_CUR)
+
+def _embedded_fields(exif_dict):
+    """
+    Returns the EXIF values written by embed_full_exif_jpeg, for comparing
+    an image's EXIF before and after embedding.
+    """
+    return (
+        exif_dict['Exif'].get(piexif.ExifIFD.DateTimeOriginal),
+        exif_dict['Exif'].get(piexif.ExifIFD.DateTimeDigitized),
+        exif_dict['0th'].get(piexif.ImageIFD.DateTime),
+        exif_dict['Exif'].get(piexif.ExifIFD.UserComment),
+        exif_dict['GPS'],
+    )
+
 def embed_full_exif_jpeg(image_path, json_data, datetime_str):
     """
     Embeds full EXIF metadata (time, GPS, UserComment) into a JPEG image.
     Modifies the image file in place.
     """
     try:
-        exif_dict = piexif.load(image_path)
+        # Parse only the EXIF segment first; the whole JPEG is read (once) only
+        # when it actually has to be rewritten
+        image_data = None
+        exif_segment = read_jpeg_exif(image_path)
+        if exif_segment:
+            exif_dict = piexif.load(exif_segment)
+        else:
+            image_data = read_file(image_path)
+            exif_dict = piexif.load(image_data)
+        original = _embedded_fields(exif_dict)
 
         # Set time
         if datetime_str:
@@ -104,103 +255,261 @@ def embed_full_exif_jpeg(image_path, json_data, datetime_str):
         try:
             # Ensure the JSON string for UserComment is not too long for EXIF standard
             # Some parsers might truncate if > 64KB, but typically much smaller.
-            short_json = {
-                "device": json_data.get("googlePhotosOrigin", {}).get("mobileUpload", {}).get("deviceType"),
-                "url": json_data.get("url"),
-                "imageViews": json_data.get("imageViews")
-            }
-            user_comment = json.dumps(short_json)
-            # Add a prefix to indicate encoding and version as per EXIF standard
-            exif_dict['Exif'][piexif.ExifIFD.UserComment] = piexif.ImageIFD.UserComment.encode('utf-8') + user_comment.encode('utf-8')
+            device = _deep_get(json_data, DEVICE_TYPE_KEYS)
+            url = json_data.get("url")
+            image_views = json_data.get("imageViews")
+            # Nothing to record, so leave any existing UserComment alone
+            if device is not None or url is not None or image_views is not None:
+                short_json = {
+                    "device": device,
+                    "url": url,
+                    "imageViews": image_views
+                }
+                user_comment = json.dumps(short_json)
+                # UserComment.dump adds the 8-byte character code prefix required by the EXIF standard
+                exif_dict['Exif'][piexif.ExifIFD.UserComment] = UserComment.dump(user_comment, encoding="unicode")
         except Exception as ue:
             print(f"⚠️ Failed to set UserComment: {ue}")
 
+        # Already embedded by an earlier run, no need to rewrite the file
+        if _embedded_fields(exif_dict) == original:
+            return True
+
+        if image_data is None:
+            image_data = read_file(image_path)
         exif_bytes = piexif.dump(exif_dict)
-        piexif.insert(exif_bytes, image_path)
+        output = io.BytesIO()
+        piexif.insert(exif_bytes, image_data, output)
+        write_file_atomic(image_path, output.getvalue())
         return True
     except Exception as e:
         print(f"⚠️ Failed to embed full EXIF into {image_path}: {e}")
         return False
 
-def embed_metadata_png(image_path, json_data, datetime_str):
+def _png_chunk(chunk_type, data):
+    """
+    Builds a raw PNG chunk: length, type, data and the CRC32 over type + data.
+    """
+    crc = zlib.crc32(chunk_type + data) & 0xffffffff
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", crc)
+
+def splice_png_text(image_path, keyword, text):
+    """
+    Writes a tEXt chunk into a PNG file without decoding or re-encoding the image.
+    The new chunk is placed right before the first IDAT chunk, replacing any
+    existing tEXt chunk with the same keyword. The pixel data is copied as-is,
+    and the file is replaced atomically through a temporary file.
+    The source is opened once: the chunks before IDAT are read to decide whether
+    a rewrite is needed, and the rest is copied from the same file object.
+    Returns False (without touching the file) if the same text is already there.
+    """
+    key = keyword.encode('latin-1')
+    data = key + b"\x00" + text.encode('latin-1')
+    with open(image_path, "rb") as src:
+        if src.read(8) != PNG_SIGNATURE:
+            raise ValueError("not a PNG file")
+        # The chunks before IDAT are small (IHDR, palette, text...), so keep them in memory
+        head_chunks = []
+        while True:
+            header = src.read(8)
+            if len(header) < 8:
+                raise ValueError("no IDAT chunk found")
+            length, chunk_type = struct.unpack(">I4s", header)
+            if chunk_type == b"IDAT":
+                break
+            body = src.read(length + 4) # chunk data + CRC
+            if chunk_type == b"tEXt" and body.split(b"\x00", 1)[0] == key:
+                if body[:-4] == data:
+                    return False # Already embedded by an earlier run
+                continue # Drop the old chunk, the new one replaces it
+            head_chunks.append(header + body)
+        with _atomic_replace(image_path) as dst:
+            dst.write(PNG_SIGNATURE)
+            dst.writelines(head_chunks)
+            dst.write(_png_chunk(b"tEXt", data))
+            # Everything from the first IDAT up to IEND is copied untouched
+            dst.write(header)
+            shutil.copyfileobj(src, dst)
+            # Release the source before it is replaced (required on Windows)
+            src.close()
+    return True
+
+def embed_metadata_png(image_path, json_data, datetime_str, ts=None):
     """
     Embeds selected metadata into a PNG image using tEXt chunks.
     PNGs do not support EXIF directly like JPEGs.
+    The chunk is spliced into the file directly, so the image data is never re-encoded.
+    If ts is given, the file's access/modification time is then set to it, since
+    viewers fall back to the file time for PNGs without EXIF.
     """
     try:
-        im = Image.open(image_path)
-        meta = PngImagePlugin.PngInfo()
-
         # Example metadata inserted into 'UserComment' tEXt chunk
         # It's good practice to include a creation time if possible in PNG metadata too
         short_json = {
             "dateTimeOriginal": datetime_str,
-            "device": json_data.get("googlePhotosOrigin", {}).get("mobileUpload", {}).get("deviceType"),
+            "device": _deep_get(json_data, DEVICE_TYPE_KEYS),
             "url": json_data.get("url"),
             "imageViews": json_data.get("imageViews")
         }
+        # json.dumps escapes non-ASCII characters, so the text is always valid Latin-1 for tEXt
         user_comment = json.dumps(short_json)
-        meta.add_text("UserComment", user_comment) # Standardized chunk name
 
         # Optionally, you might add a 'Creation Time' for PNGs if desired
         # although its interpretation can vary by viewer
         # try:
         #     if datetime_str:
         #         # PNG 'Creation Time' usually follows ISO 8601 format
-        #         dt_iso = datetime.fromtimestamp(int(json_data['photoTakenTime']['timestamp']), timezone.utc).isoformat(timespec='seconds') + 'Z'
-        #         meta.add_text("Creation Time", dt_iso)
+        #         dt_iso = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(int(json_data['photoTakenTime']['timestamp'])))
+        #         splice_png_text(image_path, "Creation Time", dt_iso)
         # except Exception as tce:
         #     print(f"⚠️ Failed to set PNG Creation Time: {tce}")
 
-        # Save again with inserted metadata
-        im.save(image_path, "PNG", pnginfo=meta)
+        # Leaves the file alone if an earlier run already embedded the same text
+        splice_png_text(image_path, "UserComment", user_comment) # Standardized chunk name
+        if ts is not None:
+            os.utime(image_path, (ts, ts))
         return True
     except Exception as e:
         print(f"⚠️ Failed to embed PNG metadata into {image_path}: {e}")
         return False
 
-def process_directory(directory):
+def _process_one(media_path, kind, json_path, prefetched=None):
+    """
+    Reads the JSON metadata for a single media file and embeds it.
+    kind is the image kind returned by classify_image and json_path the
+    sidecar found by find_json_file (None if there is none).
+    Returns a (path, status, detail) tuple, where detail is the date/time string
+    on success or the JSON path when the JSON could not be read.
+    """
+    if not json_path:
+        return media_path, STATUS_NO_JSON, None
+    metadata, dt_str, ts = read_json_metadata(json_path, prefetched)
+    if not metadata:
+        return media_path, STATUS_JSON_FAILED, json_path
+    if kind == 'jpeg':
+        success = embed_full_exif_jpeg(media_path, metadata, dt_str)
+    elif kind == 'png':
+        success = embed_metadata_png(media_path, metadata, dt_str, ts)
+        if success and ts is not None:
+            return media_path, STATUS_TIMESTAMPED, dt_str
+    else:
+        print(f"⚠️ Format {media_path} is not supported for EXIF/metadata embedding by this script.")
+        success = False # Mark as failed if format is not supported
+    return media_path, STATUS_EMBEDDED if success else STATUS_FAILED, dt_str
+
+def _get_prefetch_pool():
+    """
+    Returns this process's JSON prefetch thread pool, creating it on first use,
+    so each worker process reuses one pool for all of its batches.
+    """
+    global _prefetch_pool
+    if _prefetch_pool is None:
+        _prefetch_pool = ThreadPoolExecutor(max_workers=JSON_PREFETCH_THREADS)
+    return _prefetch_pool
+
+def _process_batch(batch):
+    """
+    Processes a batch of (media_path, kind, json_path) items inside a worker process.
+    The JSON files of the batch are read ahead by a few threads, so reading the
+    next sidecars overlaps with embedding the current image.
+    Only reports back what happened and leaves the logging to the parent.
+    Returns the list of _process_one results, in batch order.
+    """
+    pool = _get_prefetch_pool()
+    futures = [pool.submit(read_file, json_path) if json_path else None
+               for _, _, json_path in batch]
+    return [_process_one(media_path, kind, json_path, future)
+            for (media_path, kind, json_path), future in zip(batch, futures)]
+
+def _walk(directory):
+    """
+    Recursively scans a directory tree with os.scandir, top-down like os.walk.
+    Yields one list of file DirEntry objects per directory; DirEntry.path is
+    built by scandir and its type comes from the listing, so no extra stat()
+    or os.path.join is needed per file.
+    Unreadable directories are skipped, and symlinked directories are not followed.
+    """
+    files, subdirs = [], []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file():
+                    files.append(entry)
+    except OSError:
+        return
+    yield files
+    for subdir in subdirs:
+        yield from _walk(subdir)
+
+def process_directory(directory, verbose=False):
     """
     Walks through the specified directory, finds image files and their
     associated JSON metadata, and embeds the metadata into the images.
+    The images are processed in parallel by a pool of worker processes.
     Logs the success/failure of each operation.
+    Progress is shown as a tqdm progress bar if tqdm is installed; with
+    verbose=True the log line of every image is printed as its result arrives.
     """
+    items = []
+    for files in _walk(directory):
+        # Split the listing into images and JSON sidecars in one pass; the sidecars
+        # are then looked up in that mapping and never considered as images
+        images, json_names = [], {}
+        for entry in files:
+            name = entry.name
+            lower_name = name.lower()
+            if lower_name.endswith('.json'):
+                # Exact names always win over the lower-cased fallback keys
+                json_names[name] = name
+                json_names.setdefault(lower_name, name)
+            else:
+                kind = classify_image(lower_name)
+                if kind:
+                    images.append((entry.path, kind))
+        for media_path, kind in images:
+            items.append((media_path, kind, find_json_file(media_path, json_names)))
+    batches = [items[i:i + BATCH_SIZE] for i in range(0, len(items), BATCH_SIZE)]
+
     successful_images, failed_images = [], []
-    with open("embed_log.txt", "w") as log_file:
-        for root, _, files in os.walk(directory):
-            for file in files:
-                if is_image(file):
-                    media_path = os.path.join(root, file)
-                    print(f"🖼️ Checking and embedding metadata: {media_path}")
-                    json_path = find_json_file(media_path)
-                    if json_path:
-                        metadata, dt_str = read_json_metadata(json_path)
-                        if metadata:
-                            if is_jpeg(media_path):
-                                success = embed_full_exif_jpeg(media_path, metadata, dt_str)
-                            elif is_png(media_path):
-                                success = embed_metadata_png(media_path, metadata, dt_str)
-                            else:
-                                print(f"⚠️ Format {media_path} is not supported for EXIF/metadata embedding by this script.")
-                                success = False # Mark as failed if format is not supported
-                            if success:
-                                successful_images.append(media_path)
-                                log_file.write(f"IMAGE EMBEDDED SUCCESSFULLY: {media_path} with date/time {dt_str}\n")
-                            else:
-                                failed_images.append(media_path)
-                                log_file.write(f"IMAGE EMBEDDING FAILED: {media_path}\n")
-                        else:
-                            failed_images.append(media_path)
-                            log_file.write(f"FAILED TO READ JSON METADATA: {json_path}\n")
+    # Log lines are collected here and written to embed_log.txt in one go at the end
+    log_lines = []
+    progress = tqdm(total=len(items), unit="image") if tqdm and not verbose else None
+    # The default worker count is the CPU count (capped on Windows, which allows at most 61)
+    with ProcessPoolExecutor() as executor:
+        for results in executor.map(_process_batch, batches):
+            for media_path, status, detail in results:
+                first_line = len(log_lines)
+                if status in (STATUS_EMBEDDED, STATUS_TIMESTAMPED):
+                    successful_images.append(media_path)
+                    log_lines.append(f"IMAGE EMBEDDED SUCCESSFULLY: {media_path} with date/time {detail}\n")
+                    if status == STATUS_TIMESTAMPED:
+                        log_lines.append(f"FILE TIMESTAMP UPDATED: {media_path} to {detail}\n")
+                else:
+                    failed_images.append(media_path)
+                    if status == STATUS_FAILED:
+                        log_lines.append(f"IMAGE EMBEDDING FAILED: {media_path}\n")
+                    elif status == STATUS_JSON_FAILED:
+                        log_lines.append(f"FAILED TO READ JSON METADATA: {detail}\n")
                     else:
-                        failed_images.append(media_path)
-                        log_file.write(f"NO JSON METADATA FILE FOUND: {media_path}\n")
+                        log_lines.append(f"NO JSON METADATA FILE FOUND: {media_path}\n")
+                # Printed here in the parent, so output from the workers never interleaves
+                if verbose:
+                    print("🖼️ " + "🖼️ ".join(log_lines[first_line:]), end="")
+            if progress:
+                progress.update(len(results))
+    if progress:
+        progress.close()
+    with open("embed_log.txt", "w") as log_file:
+        log_file.write("".join(log_lines))
     print(f"✅ Done. Successful: {len(successful_images)}, Failed: {len(failed_images)}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Embeds Google Photos JSON metadata (timestamp, GPS, etc.) into image files (JPG/PNG).")
     parser.add_argument('base_folder', help='Path to the root directory containing your Google Photos Takeout data (e.g., the "Google Photos" folder).')
+    parser.add_argument('--verbose', action='store_true', help='Print every image as it is processed instead of showing a progress bar.')
     args = parser.parse_args()
 
     # The base_folder will now be taken from the command-line argument
-    process_directory(args.base_folder)
\ No newline at end of file
+    process_directory(args.base_folder, verbose=args.verbose)
\ No newline at end of file
@@ -1,22 +1,52 @@
 import os
+import functools
 import json
-from datetime import datetime, timezone
+import sys
+import time
 import argparse # Import the argparse module
+from concurrent.futures import ThreadPoolExecutor
 
-def find_json_file(media_path):
+# orjson is optional; it parses the JSON sidecars noticeably faster than the stdlib
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# Sidecar suffixes tried by find_json_file, in order of preference
+JSON_SUFFIXES = (
+    '.supplemental-metadata.json',
+    '.suppl.json',
+    '.json', # Added as a common Google Takeout JSON naming convention
+)
+
+# Number of 'Timestamp updated' lines buffered before they are written out
+LOG_FLUSH_EVERY = 1000
+
+# Number of PNGs whose JSON read / timestamp update are in flight at once
+IO_THREADS = 64
+
+# Outcomes of restore_timestamp
+STATUS_UPDATED = "updated"
+STATUS_UNCHANGED = "unchanged"
+STATUS_FAILED = "failed"
+
+def find_json_file(media_path, filenames):
     """
     Attempts to find the Google Photos metadata JSON file associated with a media file.
     Checks for .supplemental-metadata.json, .suppl.json, and .json suffixes.
     This function is adapted from the more comprehensive script for better robustness.
+    filenames maps the names in the media file's directory (as built by the
+    directory walk) to themselves, plus each lower-cased name to a real name,
+    so no stat() is needed per candidate. An exact match wins; otherwise the
+    candidate is matched case-insensitively, like on case-insensitive volumes.
     """
-    candidates = [
-        media_path + '.supplemental-metadata.json',
-        media_path + '.suppl.json',
-        media_path + '.json' # Added as a common Google Takeout JSON naming convention
-    ]
-    for path in candidates:
-        if os.path.exists(path):
-            return path
+    root, name = os.path.split(media_path)
+    for suffix in JSON_SUFFIXES:
+        candidate = name + suffix
+        found = filenames.get(candidate) or filenames.get(candidate.lower())
+        if found:
+            return os.path.join(root, found)
     return None
 
 def get_photo_timestamp(json_path):
@@ -25,8 +55,8 @@ def get_photo_timestamp(json_path):
     Returns the Unix timestamp (integer) or None if not found/error.
     """
     try:
-        with open(json_path, 'r') as f:
-            metadata = json.load(f)
+        with open(json_path, 'rb') as f:
+            metadata = json_loads(f.read())
         if 'photoTakenTime' in metadata and 'timestamp' in metadata['photoTakenTime']:
             ts = int(metadata['photoTakenTime']['timestamp'])
             return ts
@@ -51,14 +81,71 @@ def update_file_timestamp(file_path, new_timestamp):
         print(f"⚠️ Failed to change file timestamp: {file_path} ➤ {e}")
         return False
 
-def process_pngs(base_dir):
+@functools.lru_cache(maxsize=4096)
+def _day_str(day):
+    """Formats a day number (days since the Unix epoch) as 'YYYY-MM-DD', cached since photos cluster by day."""
+    tm = time.gmtime(day * 86400)
+    return "%04d-%02d-%02d" % (tm.tm_year, tm.tm_mon, tm.tm_mday)
+
+def format_timestamp(ts):
+    """Formats a Unix timestamp as a 'YYYY-MM-DD HH:MM:SS' UTC string for logging."""
+    day, secs = divmod(ts, 86400)
+    hours, secs = divmod(secs, 3600)
+    minutes, secs = divmod(secs, 60)
+    return "%s %02d:%02d:%02d" % (_day_str(day), hours, minutes, secs)
+
+def flush_updated(updated):
+    """
+    Writes the buffered 'Timestamp updated' lines for (file, timestamp) pairs
+    in a single write to stdout, then empties the buffer.
+    """
+    sys.stdout.write("".join(f"✅ Timestamp updated: {file} ➤ {format_timestamp(ts)}\n" for file, ts in updated))
+    sys.stdout.flush()
+    updated.clear()
+
+def restore_timestamp(image_path, json_path):
+    """
+    Reads the photo's timestamp from its JSON metadata and applies it to the image file.
+    Runs on a worker thread; returns a (status, timestamp) tuple where status is
+    one of STATUS_UPDATED, STATUS_UNCHANGED or STATUS_FAILED.
+    """
+    # Get the timestamp from the JSON file
+    ts = get_photo_timestamp(json_path)
+    if ts is None:
+        return STATUS_FAILED, None
+
+    # Skip files whose timestamp was already restored by an earlier run
+    try:
+        if int(os.stat(image_path).st_mtime) == ts:
+            return STATUS_UNCHANGED, ts
+    except OSError:
+        pass # Let update_file_timestamp report the problem
+
+    # Update the PNG file's timestamp
+    if update_file_timestamp(image_path, ts):
+        return STATUS_UPDATED, ts
+    return STATUS_FAILED, ts
+
+def process_pngs(base_dir, quiet=False):
     """
     Walks through the specified base directory to find PNG files and their
     associated JSON metadata, then updates the PNG file's timestamp.
+    The work is pure I/O (reading JSON, os.utime), so the files are handled
+    by a pool of IO_THREADS threads to overlap per-file latency.
+    Successful updates are reported in batches of LOG_FLUSH_EVERY lines;
+    with quiet=True no per-file lines are printed at all, only the summary.
     """
     print(f"🔍 Processing PNGs in: {base_dir}")
-    success, failed, skipped = [], [], []
+    success, failed, skipped, unchanged = [], [], [], []
+    updated = [] # (file, timestamp) pairs not yet reported
+    pending = [] # (image_path, file, json_path) for PNGs with JSON metadata
     for root, _, files in os.walk(base_dir):
+        # os.walk already listed the directory, so look the sidecars up in that listing
+        filenames = {}
+        for file in files:
+            # Exact names always win over the lower-cased fallback keys
+            filenames[file] = file
+            filenames.setdefault(file.lower(), file)
         for file in files:
             # Skip files that are not PNGs
             if not file.lower().endswith('.png'):
@@ -67,33 +154,40 @@ def process_pngs(base_dir):
             image_path = os.path.join(root, file)
             
             # Use the more robust find_json_file function to locate the JSON
-            json_path = find_json_file(image_path)
+            json_path = find_json_file(image_path, filenames)
 
             # Skip if no associated JSON metadata file is found
             if not json_path: # `find_json_file` returns None if not found
                 skipped.append(image_path)
-                print(f"⏭️ No JSON metadata found for: {file}")
+                if not quiet:
+                    print(f"⏭️ No JSON metadata found for: {file}")
                 continue
 
-            # Get the timestamp from the JSON file
-            ts = get_photo_timestamp(json_path)
-            if ts is None:
-                failed.append(image_path)
-                continue # Skip to the next file if timestamp could not be retrieved
+            pending.append((image_path, file, json_path))
 
-            # Update the PNG file's timestamp
-            if update_file_timestamp(image_path, ts):
+    with ThreadPoolExecutor(max_workers=IO_THREADS) as executor:
+        results = executor.map(restore_timestamp,
+                               [image_path for image_path, _, _ in pending],
+                               [json_path for _, _, json_path in pending])
+        for (image_path, file, _), (status, ts) in zip(pending, results):
+            if status == STATUS_UPDATED:
                 success.append(image_path)
-                # For logging, convert timestamp back to readable date/time string
-                dt = datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
-                print(f"✅ Timestamp updated: {file} ➤ {dt}")
+                if not quiet:
+                    updated.append((file, ts))
+                    if len(updated) >= LOG_FLUSH_EVERY:
+                        flush_updated(updated)
+            elif status == STATUS_UNCHANGED:
+                unchanged.append(image_path)
             else:
-                failed.append(image_path) # Add to failed list if update_file_timestamp fails
+                failed.append(image_path)
 
+    if updated:
+        flush_updated(updated)
     print("\n=== SUMMARY ===")
     print(f"🟢 Timestamps successfully updated: {len(success)}")
     print(f"🔴 Failed: {len(failed)}")
     print(f"⚪ Skipped (no JSON found): {len(skipped)}")
+    print(f"🔵 Already up to date: {len(unchanged)}")
 
 if __name__ == "__main__":
     # Set up command-line argument parsing
@@ -106,8 +200,13 @@ if __name__ == "__main__":
         help='Path to the root directory containing your Google Photos Takeout data (e.g., the "Google Photos" folder) '
              'or a specific subfolder within it.'
     )
+    parser.add_argument(
+        '--quiet',
+        action='store_true',
+        help='Only print the summary, not a line per processed PNG.'
+    )
     args = parser.parse_args()
 
     # The base_folder will now be taken from the command-line argument
-    process_pngs(args.base_folder)
+    process_pngs(args.base_folder, quiet=args.quiet)
     # print("SUCCESS!!")
\ No newline at end of file